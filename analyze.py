@@ -16,19 +16,38 @@ Usage:
 """
 
 import argparse
+import csv
 import datetime as dt
 import io
 import json
 import subprocess
 import sys
+import tempfile
 from pathlib import Path
-from typing import Any, Iterator, Optional
+from typing import Any, Optional
 
+import numpy as np
 import pandas as pd
 from huggingface_hub import HfApi, hf_hub_download
 from huggingface_hub.utils import EntryNotFoundError
 from huggingface_hub import CommitOperationAdd
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = None
+
 
 BASE_FIELDS = [
     "name",
@@ -54,60 +73,142 @@ METRIC_FIELDS = [
     "metrics.duplication.lines_other",
 ]
 
+# reports larger than this are parsed incrementally with ijson (if installed) to limit peak memory
+STREAMING_MIN_BYTES = 50_000_000
 
-def _iter_nodes(node: dict[str, Any], parent: Optional[tuple[str, ...]] = None) -> Iterator[dict[str, Any]]:
-    parent = parent or tuple()
-
-    row: dict[str, Any] = {
-        k: node.get(k)
-        for k in [
-            "name",
-            "nodetype",
-            "path",
-            "qualname",
-            "lineno",
-            "end_lineno",
-            "docstring",
-        ]
-    }
-
-    if not row.get("qualname"):
-        row["qual_or_name"] = row.get("qualname") or row.get("name")
-    else:
-        row["qual_or_name"] = row["qualname"]
+# shared stand-in for missing "metrics"/"duplication" dicts in _collect_rows, never mutated
+_EMPTY: dict[str, Any] = {}
+
+# column order of the rows built by _collect_rows
+ALL_COLUMNS = (*BASE_FIELDS, "qual_or_name", "has_metrics", "is_directory", "is_file", *METRIC_FIELDS)
+
+# metric columns that process_df fills with 0 and casts
+INT_METRIC_FIELDS = [
+    "metrics.lines",
+    "metrics.statements",
+    "metrics.expressions",
+    "metrics.expression_statements",
+    "metrics.cyclomatic_complexity",
+    "metrics.parameters",
+    "metrics.todo_comments",
+    "metrics.duplication.lines_other",
+]
+
+FLOAT_METRIC_FIELDS = [
+    "metrics.duplication.score",
+]
 
-    m = node.get("metrics") or {}
-    row["metrics.lines"] = m.get("lines")
-    row["metrics.statements"] = m.get("statements")
-    row["metrics.expressions"] = m.get("expressions")
-    row["metrics.expression_statements"] = m.get("expression_statements")
-    row["metrics.cyclomatic_complexity"] = m.get("cyclomatic_complexity")
-    row["metrics.parameters"] = m.get("parameters")
-    row["metrics.type_coverage"] = m.get("type_coverage")
-    row["metrics.todo_comments"] = m.get("todo_comments")
+# metric columns summarized by mean/max/min/quantiles in aggregate_metrics
+AGG_METRIC_FIELDS = [
+    "metrics.lines",
+    "metrics.statements",
+    "metrics.expressions",
+    "metrics.cyclomatic_complexity",
+    "metrics.parameters",
+    "metrics.type_coverage",
+    "metrics.duplication.score",
+]
 
-    dup = (m or {}).get("duplication") or {}
-    row["metrics.duplication.score"] = dup.get("score")
-    row["metrics.duplication.other"] = dup.get("other")
-    row["metrics.duplication.lines_other"] = dup.get("lines_other")
 
-    row["has_metrics"] = bool(m)
-    row["is_directory"] = row.get("nodetype") == "directory"
-    row["is_file"] = row.get("nodetype") == "file"
+def _collect_rows(root: dict[str, Any]) -> list[tuple[Any, ...]]:
+    """Walk the report tree (pre-order, without recursion) and return one row tuple per node (in ALL_COLUMNS order)
 
-    yield row
+    Missing count metrics are stored as 0 right away so that the DataFrame gets int64/float64 columns instead of
+    object columns. type_coverage is left as is, since a missing value should not count as 0% coverage.
+    """
+    rows: list[tuple[Any, ...]] = []
+    append = rows.append
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        name = node.get("name")
+        nodetype = node.get("nodetype")
+        qualname = node.get("qualname")
+        m = node.get("metrics") or _EMPTY
+        dup = m.get("duplication") or _EMPTY
+        append(
+            (
+                name,
+                nodetype,
+                node.get("path"),
+                qualname,
+                node.get("lineno"),
+                node.get("end_lineno"),
+                node.get("docstring"),
+                qualname or name,
+                bool(m),
+                nodetype == "directory",
+                nodetype == "file",
+                m.get("lines") or 0,
+                m.get("statements") or 0,
+                m.get("expressions") or 0,
+                m.get("expression_statements") or 0,
+                m.get("cyclomatic_complexity") or 0,
+                m.get("parameters") or 0,
+                m.get("type_coverage"),
+                m.get("todo_comments") or 0,
+                float(dup.get("score") or 0.0),
+                dup.get("other"),
+                dup.get("lines_other") or 0,
+            )
+        )
+        children = node.get("children")
+        if children:
+            stack.extend(reversed(children))
+    return rows
 
-    for child in node.get("children", []) or []:
-        yield from _iter_nodes(child, parent)
+
+def _collect_rows_streaming(path: Path) -> list[tuple[Any, ...]]:
+    """Like _collect_rows, but parse the report incrementally with ijson
+
+    Only the root's own fields and one child subtree of the root are held in memory at a time.
+    """
+    root: dict[str, Any] = {}
+    child_rows: list[tuple[Any, ...]] = []
+    builder = None
+    depth = 0
+    key = None
+    with open(path, "rb") as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if builder is not None:
+                builder.event(event, value)
+                if event in ("start_map", "start_array"):
+                    depth += 1
+                elif event in ("end_map", "end_array"):
+                    depth -= 1
+                if depth == 0:
+                    if key == "children":
+                        child_rows.extend(_collect_rows(builder.value))
+                    else:
+                        root[key] = builder.value
+                    builder = None
+                continue
+
+            if prefix == "":
+                if event == "map_key":
+                    key = value
+            elif prefix == "children.item" or (prefix == key and key != "children"):
+                if event in ("start_map", "start_array"):
+                    builder = ijson.ObjectBuilder()
+                    builder.event(event, value)
+                    depth = 1
+                else:
+                    root[key] = value
+
+    return _collect_rows(root) + child_rows
 
 
 def load_report_to_df(path: str | Path, *, only_leaves: bool = False) -> pd.DataFrame:
-    data = json.loads(Path(path).read_text(encoding="utf-8"))
-    rows = list(_iter_nodes(data))
-    df = pd.DataFrame.from_records(
-        rows,
-        columns=BASE_FIELDS + ["qual_or_name", "has_metrics", "is_directory", "is_file"] + METRIC_FIELDS,
-    )
+    path = Path(path)
+    if ijson is not None and path.stat().st_size > STREAMING_MIN_BYTES:
+        rows = _collect_rows_streaming(path)
+    else:
+        if orjson is not None:
+            data = orjson.loads(path.read_bytes())
+        else:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        rows = _collect_rows(data)
+    df = pd.DataFrame(rows, columns=ALL_COLUMNS)
 
     if only_leaves:
         df = df[df["has_metrics"]].reset_index(drop=True)
@@ -116,15 +217,8 @@ def load_report_to_df(path: str | Path, *, only_leaves: bool = False) -> pd.Data
 
 
 def process_df(df: pd.DataFrame) -> pd.DataFrame:
-    df["metrics.lines"] = df["metrics.lines"].fillna(0.0).astype(int)
-    df["metrics.statements"] = df["metrics.statements"].fillna(0.0).astype(int)
-    df["metrics.expressions"] = df["metrics.expressions"].fillna(0.0).astype(int)
-    df["metrics.expression_statements"] = df["metrics.expression_statements"].fillna(0.0).astype(int)
-    df["metrics.cyclomatic_complexity"] = df["metrics.cyclomatic_complexity"].fillna(0.0).astype(int)
-    df["metrics.parameters"] = df["metrics.parameters"].fillna(0.0).astype(int)
-    df["metrics.todo_comments"] = df["metrics.todo_comments"].fillna(0.0).astype(int)
-    df["metrics.duplication.lines_other"] = df["metrics.duplication.lines_other"].fillna(0.0).astype(int)
-    df["metrics.duplication.score"] = df["metrics.duplication.score"].fillna(0.0).astype(float)
+    df[INT_METRIC_FIELDS] = df[INT_METRIC_FIELDS].fillna(0.0).astype(int)
+    df[FLOAT_METRIC_FIELDS] = df[FLOAT_METRIC_FIELDS].fillna(0.0).astype(float)
     return df
 
 
@@ -151,42 +245,61 @@ def cloc_metrics(path: Path) -> dict[str, int]:
     return result
 
 
+def _count_docstrings(docstrings: pd.Series) -> tuple[int, int]:
+    """Return the number of non-empty and of empty docstrings; missing (None) docstrings count as neither"""
+    if pa is not None:
+        # a single vectorized pass over the string buffer instead of a Python-level len() per element
+        doc_len = pc.utf8_length(pa.array(docstrings, type=pa.string()))
+        return pc.sum(pc.greater(doc_len, 0)).as_py() or 0, pc.sum(pc.equal(doc_len, 0)).as_py() or 0
+
+    doc_len = docstrings.str.len()
+    return int((doc_len > 0).sum()), int((doc_len == 0).sum())
+
+
 def aggregate_metrics(df: pd.DataFrame, date: str) -> dict[str, float | int | str]:
     result: dict[str, float | int | str] = {}
     result["date"] = date
-    result["docstring coverage"] = float((df["docstring"].str.len() > 0).mean().round(4))
-    result["docstring missing"] = int((df["docstring"].str.len() == 0).sum())
+    num_documented, num_empty = _count_docstrings(df["docstring"])
+    result["docstring coverage"] = round(num_documented / len(df), 4)
+    result["docstring missing"] = num_empty
+
+    # one contiguous float array for all summarized columns; the nan* reductions skip missing values like pandas does
+    values = df[AGG_METRIC_FIELDS].to_numpy(dtype=np.float64)
+    mean = dict(zip(AGG_METRIC_FIELDS, np.nanmean(values, axis=0)))
+    max_ = dict(zip(AGG_METRIC_FIELDS, np.nanmax(values, axis=0)))
+    min_ = dict(zip(AGG_METRIC_FIELDS, np.nanmin(values, axis=0)))
+    q50, q90 = (dict(zip(AGG_METRIC_FIELDS, q)) for q in np.nanquantile(values, [0.5, 0.9], axis=0))
 
-    result["lines mean"] = float(df["metrics.lines"].mean().round(4))
-    result["lines max"] = int(df["metrics.lines"].max())
-    result["lines 90th-percentile"] = int(df["metrics.lines"].quantile(0.9))
+    result["lines mean"] = float(mean["metrics.lines"].round(4))
+    result["lines max"] = int(max_["metrics.lines"])
+    result["lines 90th-percentile"] = int(q90["metrics.lines"])
 
-    result["statements mean"] = float(df["metrics.statements"].mean().round(4))
-    result["statements max"] = int(df["metrics.statements"].max())
-    result["statements 90th-percentile"] = int(df["metrics.statements"].quantile(0.9))
+    result["statements mean"] = float(mean["metrics.statements"].round(4))
+    result["statements max"] = int(max_["metrics.statements"])
+    result["statements 90th-percentile"] = int(q90["metrics.statements"])
 
-    result["expressions mean"] = float(df["metrics.expressions"].mean().round(4))
-    result["expressions max"] = int(df["metrics.expressions"].max())
-    result["expressions 90th-percentile"] = int(df["metrics.expressions"].quantile(0.9))
+    result["expressions mean"] = float(mean["metrics.expressions"].round(4))
+    result["expressions max"] = int(max_["metrics.expressions"])
+    result["expressions 90th-percentile"] = int(q90["metrics.expressions"])
 
-    result["cyclomatic_complexity mean"] = float(df["metrics.cyclomatic_complexity"].mean().round(4))
-    result["cyclomatic_complexity max"] = int(df["metrics.cyclomatic_complexity"].max())
-    result["cyclomatic_complexity 90th-percentile"] = int(df["metrics.cyclomatic_complexity"].quantile(0.9))
+    result["cyclomatic_complexity mean"] = float(mean["metrics.cyclomatic_complexity"].round(4))
+    result["cyclomatic_complexity max"] = int(max_["metrics.cyclomatic_complexity"])
+    result["cyclomatic_complexity 90th-percentile"] = int(q90["metrics.cyclomatic_complexity"])
 
-    result["parameters mean"] = float(df["metrics.parameters"].mean().round(4))
-    result["parameters max"] = int(df["metrics.parameters"].max())
-    result["parameters 90th-percentile"] = int(df["metrics.parameters"].quantile(0.9))
+    result["parameters mean"] = float(mean["metrics.parameters"].round(4))
+    result["parameters max"] = int(max_["metrics.parameters"])
+    result["parameters 90th-percentile"] = int(q90["metrics.parameters"])
 
-    result["type_coverage mean"] = float(df["metrics.type_coverage"].mean().round(4))
-    result["type_coverage min"] = int(df["metrics.type_coverage"].min())
-    result["type_coverage 50th-percentile"] = int(df["metrics.type_coverage"].quantile(0.5))
+    result["type_coverage mean"] = float(mean["metrics.type_coverage"].round(4))
+    result["type_coverage min"] = int(min_["metrics.type_coverage"])
+    result["type_coverage 50th-percentile"] = int(q50["metrics.type_coverage"])
 
     result["todo_comments total"] = int(df["metrics.todo_comments"].sum())
 
-    result["duplication.score mean"] = float(df["metrics.duplication.score"].mean().round(4))
-    result["duplication.score max"] = float(df["metrics.duplication.score"].max())
-    result["duplication.score 90th-percentile"] = float(df["metrics.duplication.score"].quantile(0.9))
-    result["duplication.score 50th-percentile"] = float(df["metrics.duplication.score"].quantile(0.5))
+    result["duplication.score mean"] = float(mean["metrics.duplication.score"].round(4))
+    result["duplication.score max"] = float(max_["metrics.duplication.score"])
+    result["duplication.score 90th-percentile"] = float(q90["metrics.duplication.score"])
+    result["duplication.score 50th-percentile"] = float(q50["metrics.duplication.score"])
     result["duplication.duplicated-lines total"] = int(
         (df["metrics.lines"] * df["metrics.duplication.score"]).sum().round(0).astype(int)
     )
@@ -201,8 +314,8 @@ def _download_space_csv_or_empty(
     repo_type: str = "space",
     revision: str = "main",
     token: Optional[str] = None,
-) -> pd.DataFrame:
-    """Try to download a CSV from a Space. If missing or empty, return an empty DataFrame."""
+) -> bytes:
+    """Try to download a CSV from a Space. If missing, return empty bytes."""
     try:
         csv_path = hf_hub_download(
             repo_id=repo_id,
@@ -213,12 +326,36 @@ def _download_space_csv_or_empty(
             local_dir=None,
         )
     except EntryNotFoundError:
-        return pd.DataFrame()
+        return b""
+
+    return Path(csv_path).read_bytes()
 
-    try:
-        return pd.read_csv(csv_path)
-    except pd.errors.EmptyDataError:
-        return pd.DataFrame()
+
+def _append_row_to_csv(csv_bytes: bytes, row: dict[str, Any]) -> bytes:
+    """Append a row to UTF-8 CSV content, adding columns for keys that are not in the header yet.
+
+    Only the header line is parsed; existing rows are only decoded and re-written when new columns have to be added.
+    """
+    header_line = csv_bytes.split(b"\n", 1)[0].decode("utf-8")
+    header = next(csv.reader([header_line]), []) if header_line else []
+    new_cols = [col for col in row if col not in header]
+
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    if new_cols:
+        records = csv.reader(io.StringIO(csv_bytes.decode("utf-8")))
+        next(records, None)
+        header = header + new_cols
+        writer.writerow(header)
+        padding = [""] * len(new_cols)
+        for record in records:
+            writer.writerow(record + padding)
+        prefix = b""
+    else:
+        prefix = csv_bytes if csv_bytes.endswith(b"\n") else csv_bytes + b"\n"
+
+    csv.DictWriter(out, fieldnames=header, lineterminator="\n").writerow(row)
+    return prefix + out.getvalue().encode("utf-8")
 
 
 def append_metrics_to_hub_csv(
@@ -237,8 +374,8 @@ def append_metrics_to_hub_csv(
     """
     api = HfApi(token=token)
 
-    # 1) Load existing CSV (or get empty df)
-    df_existing = _download_space_csv_or_empty(
+    # 1) Load existing CSV (or get empty bytes)
+    csv_existing = _download_space_csv_or_empty(
         repo_id=repo_id,
         path_in_repo=path_in_repo,
         repo_type=repo_type,
@@ -247,31 +384,24 @@ def append_metrics_to_hub_csv(
     )
 
     # 2) Append the new row; align columns (union)
-    df_new = pd.DataFrame([row])
-    all_cols = list(dict.fromkeys([*df_existing.columns.tolist(), *df_new.columns.tolist()]))
-    if df_existing.empty:
-        df_updated = df_new.reindex(columns=all_cols)
-    else:
-        df_updated = pd.concat(
-            [df_existing.reindex(columns=all_cols), df_new.reindex(columns=all_cols)],
-            ignore_index=True,
-        )
+    csv_updated = _append_row_to_csv(csv_existing, row)
 
-    # 3) Serialize to CSV bytes (UTF-8)
-    csv_bytes = df_updated.to_csv(index=False).encode("utf-8")
-    fileobj = io.BytesIO(csv_bytes)
-
-    # 4) Commit the updated CSV
+    # 3) Write the CSV to disk, so that the upload can stream (and, for Xet-backed files, chunk) it from a file
     msg = commit_message or f"append metrics row ({row.get('date', 'no-date')})"
-    commit = api.create_commit(
-        repo_id=repo_id,
-        repo_type=repo_type,
-        revision=branch,
-        operations=[
-            CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=fileobj),
-        ],
-        commit_message=msg,
-    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = Path(tmp_dir) / Path(path_in_repo).name
+        csv_path.write_bytes(csv_updated)
+
+        # 4) Commit the updated CSV
+        commit = api.create_commit(
+            repo_id=repo_id,
+            repo_type=repo_type,
+            revision=branch,
+            operations=[
+                CommitOperationAdd(path_in_repo=path_in_repo, path_or_fileobj=csv_path),
+            ],
+            commit_message=msg,
+        )
     return commit.oid
 
 
@@ -302,10 +432,7 @@ def main() -> None:
     agg.update(cloc_metrics(args.src_path))
 
     if not args.hub_repo:
-        df_row = pd.DataFrame([agg])
-        all_cols = list(dict.fromkeys(df_row.columns.tolist()))
-        df_row = df_row.reindex(columns=all_cols)
-        print(df_row.to_csv(index=False))
+        print(pd.DataFrame([agg]).to_csv(index=False))
         sys.exit(0)
 
     sha = append_metrics_to_hub_csv(
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 """
-Backfill monthly snapshots of a Git repo and run analyze.py at each snapshot.
+Backfill monthly snapshots of a Git repo and aggregate metrics (see analyze.py) for each snapshot.
 
 Example:
   python backfill.py \
@@ -11,54 +11,79 @@ Example:
       --report-name result.json
 """
 import argparse
+import bisect
+import csv
 import datetime as dt
-import io
+import multiprocessing as mp
+import os
 import sys
 import subprocess
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 from pathlib import Path
-from typing import Optional
+from typing import Any, Optional
 
-import pandas as pd
+from analyze import aggregate_metrics, cloc_metrics, load_report_to_df, process_df
 
 
 def run(cmd: list[str], *, cwd: Optional[Path] = None, check: bool = True) -> subprocess.CompletedProcess:
     return subprocess.run(cmd, cwd=str(cwd) if cwd else None, text=True, capture_output=True, check=check)
 
 
-def git_current_ref(repo: Path) -> tuple[str, str]:
-    ref = run(["git", "rev-parse", "--abbrev-ref", "HEAD"], cwd=repo).stdout.strip()
-    sha = run(["git", "rev-parse", "HEAD"], cwd=repo).stdout.strip()
-    return ref, sha
-
-
-def git_earliest_first_parent_sha(repo: Path, branch: str) -> Optional[str]:
-    """Return the earliest commit SHA on the branch's first-parent history."""
-    cp = run(["git", "rev-list", branch, "--first-parent", "--reverse"], cwd=repo, check=False)
+def git_first_parent_log(repo: Path, branch: str) -> list[tuple[str, dt.datetime]]:
+    """Return (sha, commit date) for the branch's first-parent history, oldest first."""
+    cp = run(["git", "log", branch, "--first-parent", "--reverse", "--format=%H %cI"], cwd=repo, check=False)
+    log: list[tuple[str, dt.datetime]] = []
     for line in cp.stdout.splitlines():
         line = line.strip()
-        if line:
-            return line
-    return None
+        if not line:
+            continue
+        sha, date = line.split(" ", 1)
+        log.append((sha, dt.datetime.fromisoformat(date.replace("Z", "+00:00"))))
+    return log
+
+
+def first_commit_on_or_after(shas: list[str], dates: list[dt.datetime], since: dt.datetime) -> Optional[str]:
+    """Return the first commit with a date >= since; shas and dates must be sorted by date."""
+    idx = bisect.bisect_left(dates, since)
+    return shas[idx] if idx < len(shas) else None
+
+
+# git worktree owned by the current pool worker, set by _init_worker
+_WORKTREE: Optional[Path] = None
 
 
-def git_first_commit_date(repo: Path, branch: str) -> dt.date:
-    """Return the date of the earliest first-parent commit on the branch."""
-    sha = git_earliest_first_parent_sha(repo, branch)
-    if not sha:
-        raise RuntimeError(f"No commits found on branch {branch}")
-    out = run(["git", "show", "-s", "--format=%cI", sha], cwd=repo).stdout.strip()
-    return dt.datetime.fromisoformat(out.replace("Z", "+00:00")).date()
+def _init_worker(worktrees: "mp.Queue[Path]") -> None:
+    global _WORKTREE
+    _WORKTREE = worktrees.get()
 
 
-def git_first_commit_on_or_after(repo: Path, branch: str, since_iso: str) -> Optional[str]:
-    cp = run(["git", "rev-list", branch, "--first-parent", f"--since={since_iso}", "--reverse"], cwd=repo, check=False)
-    shas = [line.strip() for line in cp.stdout.splitlines() if line.strip()]
-    return shas[0] if shas else None
+def run_snapshot(
+    sha: str, commit_dt: str, *, src_subdir: str, analyzer_dir: Path, report_name: str, skip_models: bool
+) -> tuple[bool, Any]:
+    """Check out sha in this worker's worktree, run main.py on it and aggregate the report.
 
+    Returns (True, metrics) on success and (False, stderr) if main.py failed.
+    """
+    assert _WORKTREE is not None
+    run(["git", "checkout", "--quiet", "--detach", sha], cwd=_WORKTREE)
+    src_dir = _WORKTREE / src_subdir
 
-def git_commit_date(repo: Path, sha: str) -> dt.datetime:
-    out = run(["git", "show", "-s", "--format=%cI", sha], cwd=repo).stdout.strip()
-    return dt.datetime.fromisoformat(out.replace("Z", "+00:00"))
+    # run main.py to produce JSON report for this snapshot
+    report_path = _WORKTREE.parent / f"{_WORKTREE.name}-{report_name}"
+    cmd = [sys.executable, "main.py", str(src_dir), "-o", str(report_path)]
+    # models directory is too huge in transformers, dups take too long to calculate, thus skipping it
+    if skip_models:
+        cmd += ["--ignore", str(src_dir / "transformers" / "models")]
+    cp_report = run(cmd, cwd=analyzer_dir, check=False)
+    if cp_report.returncode != 0:
+        return False, cp_report.stderr
+
+    # aggregate in-process instead of paying interpreter and pandas startup for an analyze.py subprocess
+    df = process_df(load_report_to_df(report_path, only_leaves=True))
+    agg = aggregate_metrics(df, date=commit_dt)
+    agg.update(cloc_metrics(src_dir))
+    return True, agg
 
 
 def month_starts_descending(today: Optional[dt.date] = None) -> list[dt.date]:
@@ -76,13 +101,19 @@ def month_starts_descending(today: Optional[dt.date] = None) -> list[dt.date]:
 
 
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Backfill monthly snapshots of a Git repo and run analyze.py on each.")
+    parser = argparse.ArgumentParser(description="Backfill monthly snapshots of a Git repo and aggregate metrics for each.")
     parser.add_argument("--repo", type=Path, required=True, help="Path to the target Git repository to analyze.")
     parser.add_argument("--branch", default="main", help="Branch name to traverse (default: main).")
     parser.add_argument("--src-subdir", default="src", help="Subdirectory inside repo to analyze (default: .).")
-    parser.add_argument("--analyzer-dir", type=Path, default=Path("."), help="Directory containing main.py and analyze.py.")
+    parser.add_argument("--analyzer-dir", type=Path, default=Path("."), help="Directory containing main.py.")
     parser.add_argument("--report-name", default="result.json", help="Filename for JSON report (default: result.json).")
     parser.add_argument("--max-months", type=int, default=100, help="Optional limit on number of months to process.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=max(1, (os.cpu_count() or 1) - 1),
+        help="Number of snapshots to process in parallel (default: number of CPUs - 1).",
+    )
     args = parser.parse_args()
 
     repo = args.repo.resolve()
@@ -93,84 +124,109 @@ def main() -> None:
         print(f"error: main.py not found in {analyzer_dir}", file=sys.stderr)
         sys.exit(2)
 
-    if not (Path(".") / "analyze.py").exists():
-        print("error: analyze.py not found", file=sys.stderr)
-        sys.exit(2)
-
-    start_ref, start_sha = git_current_ref(repo)
-
     try:
         run(["git", "show-ref", "--verify", f"refs/heads/{args.branch}"], cwd=repo)
     except subprocess.CalledProcessError:
         print(f"error: branch '{args.branch}' not found in {repo}", file=sys.stderr)
         sys.exit(2)
 
-    # ensure first-parent follows the chosen branch’s lineage
-    run(["git", "checkout", "--quiet", args.branch], cwd=repo)
+    # query the whole history once instead of calling git for every month and commit
+    log = git_first_parent_log(repo, args.branch)
+    if not log:
+        raise RuntimeError(f"No commits found on branch {args.branch}")
+    earliest = log[0][1].date()
+    commit_dates = dict(log)
+    log_by_date = sorted(log, key=lambda item: item[1])
+    shas_by_date = [sha for sha, _ in log_by_date]
+    dates_by_date = [date for _, date in log_by_date]
 
-    earliest = git_first_commit_date(repo, args.branch)
     starts = month_starts_descending()
     if args.max_months:
         starts = starts[: args.max_months]
 
-    dfs: list[pd.DataFrame] = []
-    seen_shas: set[str] = set()
-
-    try:
-        for month_start in starts:
-            # progress bar
-            print("|", end="", flush=True, file=sys.stderr)
-            if month_start < earliest.replace(day=1):
-                break
-
-            since_iso = dt.datetime(month_start.year, month_start.month, 1, tzinfo=dt.timezone.utc).isoformat()
-            sha = git_first_commit_on_or_after(repo, args.branch, since_iso)
-            if not sha or sha in seen_shas:
-                continue
-            seen_shas.add(sha)
-
-            # checkout snapshot
-            run(["git", "checkout", "--quiet", sha], cwd=repo)
-
-            # run main.py to produce JSON report for this snapshot
-            report_path = analyzer_dir / args.report_name
-            cmd = [sys.executable, "main.py", str(src_dir), "-o", str(report_path)]
-            # models directory is too huge in transformers, dups take too long to calculate, thus skipping it
-            if "transformers" in str(src_dir):
-                cmd += ["--ignore", str(src_dir / "transformers" / "models")]
-            cp_report = run(cmd, cwd=analyzer_dir, check=False)
-            if cp_report.returncode != 0:
-                print(f"error: main.py failed on commit {sha} ({git_commit_date(repo, sha).date().isoformat()}), aborting", file=sys.stderr)
-                print(cp_report.stderr, file=sys.stderr)
-                break
-
-            # run analyze.py (prints single-row CSV)
-            commit_dt = git_commit_date(repo, sha).date().isoformat()
-            cp_agg = run([sys.executable, "analyze.py", str(report_path), "--src-path", str(src_dir), "--date", commit_dt])
-            csv_text = cp_agg.stdout.strip()
-            if not csv_text:
-                continue
-
-            df = pd.read_csv(io.StringIO(csv_text))
-            dfs.append(df)
-
-        if not dfs:
-            print("no data collected", file=sys.stderr)
-            return
-
-        out = pd.concat(dfs, ignore_index=True)
-        if "date" in out.columns:
-            out["date"] = pd.to_datetime(out["date"])
-            out = out.sort_values("date").reset_index(drop=True)
-            out["date"] = out["date"].dt.date.astype(str)
-        sys.stdout.write(out.to_csv(index=False))
-
-    finally:
-        # restore original state
-        if start_ref == "HEAD":
-            run(["git", "checkout", "--quiet", start_sha], cwd=repo, check=False)
-        else:
-            run(["git", "checkout", "--quiet", start_ref], cwd=repo, check=False)
+    snapshots: list[str] = []
+    for month_start in starts:
+        if month_start < earliest.replace(day=1):
+            break
+
+        since = dt.datetime(month_start.year, month_start.month, 1, tzinfo=dt.timezone.utc)
+        sha = first_commit_on_or_after(shas_by_date, dates_by_date, since)
+        if not sha or sha in snapshots:
+            continue
+        snapshots.append(sha)
+
+    if not snapshots:
+        print("no data collected", file=sys.stderr)
+        return
+
+    rows: list[dict[str, Any]] = []
+    workers = max(1, min(args.workers, len(snapshots)))
+
+    # each worker checks out its snapshots in its own worktree, so the target repo itself is never touched
+    with tempfile.TemporaryDirectory(prefix="backfill-") as tmp_dir:
+        worktrees = [Path(tmp_dir) / f"worktree-{i}" for i in range(workers)]
+        worktree_queue: "mp.Queue[Path]" = mp.Queue()
+        try:
+            for worktree in worktrees:
+                run(["git", "worktree", "add", "--quiet", "--detach", str(worktree), args.branch], cwd=repo)
+                worktree_queue.put(worktree)
+
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(worktree_queue,)) as pool:
+                futures: list[Future] = []
+
+                def submit_next() -> None:
+                    # keep at most `workers` snapshots in flight; anything handed to the pool beyond that is pre-queued
+                    # and can no longer be cancelled when aborting
+                    while len(futures) < len(snapshots) and sum(not f.done() for f in futures) < workers:
+                        sha = snapshots[len(futures)]
+                        futures.append(
+                            pool.submit(
+                                run_snapshot,
+                                sha,
+                                commit_dates[sha].date().isoformat(),
+                                src_subdir=args.src_subdir,
+                                analyzer_dir=analyzer_dir,
+                                report_name=args.report_name,
+                                skip_models="transformers" in str(src_dir),
+                            )
+                        )
+
+                # consume results in month order so that a failure drops it and all older snapshots, as before
+                try:
+                    for i, sha in enumerate(snapshots):
+                        submit_next()
+                        while not futures[i].done():
+                            wait([f for f in futures if not f.done()], return_when=FIRST_COMPLETED)
+                            submit_next()
+
+                        # progress bar
+                        print("|", end="", flush=True, file=sys.stderr)
+                        ok, output = futures[i].result()
+                        if not ok:
+                            print(f"error: main.py failed on commit {sha} ({commit_dates[sha].date().isoformat()}), aborting", file=sys.stderr)
+                            print(output, file=sys.stderr)
+                            pool.shutdown(cancel_futures=True)
+                            break
+                        rows.append(output)
+                except BaseException:
+                    # a worker raised (or Ctrl+C): stop right away instead of letting the pool finish its queue
+                    pool.shutdown(cancel_futures=True)
+                    raise
+        finally:
+            for worktree in worktrees:
+                run(["git", "worktree", "remove", "--force", str(worktree)], cwd=repo, check=False)
+            run(["git", "worktree", "prune"], cwd=repo, check=False)
+
+    if not rows:
+        print("no data collected", file=sys.stderr)
+        return
+
+    # rows are plain dicts with ISO dates, so sort and write them with the csv module instead of going through pandas
+    rows.sort(key=lambda row: row["date"])
+    fieldnames = list(dict.fromkeys(key for row in rows for key in row))
+    writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(rows)
 
 
 if __name__ == "__main__":